@@ -1,4 +1,5 @@
 import glob
+import os
 import subprocess
 from pathlib import Path
 
@@ -13,13 +14,17 @@ DOIT_CONFIG = {
     "default_tasks": ["msgfmt"]
 }
 
+# Source files are listed once and shared among tasks.
+PY_SOURCES = tuple(os.fspath(i) for i in Path(PACKAGE).rglob("*.py")
+                   if i.name != "__version__.py")
+ALL_PO_SOURCES = tuple(glob.iglob("./**/*.po", recursive=True))
+PO_SOURCES = tuple(i for i in ALL_PO_SOURCES if i.startswith(f"./{PACKAGE}/"))
+
 
 def task_gettext():
     pot = f"./{PACKAGE}/locale/{PACKAGE}.pot"
-    sources = glob.glob("./**/*.py", recursive=True)
-    sources = [i for i in sources if "__version__.py" not in i]
-    command = "xgettext --add-comments=TRANSLATORS --from-code=UTF-8 -o " + pot + " " + " ".join(sources)
-    sources.append(README_BASE)
+    command = "xgettext --add-comments=TRANSLATORS --from-code=UTF-8 -o " + pot + " " + " ".join(PY_SOURCES)
+    sources = list(PY_SOURCES) + [README_BASE]
     return {
         "actions": [
             command,
@@ -40,35 +45,43 @@ def task_gettext():
 def task_msgfmt():
     languages = [i[i.rfind('/')+1:] for i in glob.glob("./readme_translations/locale/*_*")]
 
-    sources = glob.glob("./**/*.po", recursive=True)
+    sources = list(ALL_PO_SOURCES)
     dests = [i[:-3] + ".mo" for i in sources]
-    actions = [["msgfmt", sources[i], "-o", dests[i]] for i in range(len(sources))]
-
-    actions.append(["mkdir", "./.cache/source"])
-    actions.append(["cp", README_BASE, "./.cache/source/README.rst"])
-    locale_dirs = (Path('.') / "readme_translations" / "locale").absolute()
-    for i in languages:
-        actions.append(["sphinx-build", "-E", "-b", "rst", "-C",
-                        "-D", f"language={i}", "-D", f"locale_dirs={locale_dirs}",
-                        "-D", "extensions=sphinxcontrib.restbuilder",
-                        "-D", "master_doc=README", "./.cache/source", f"./.cache/{i}"])
-        actions.append(["mv", f"./.cache/{i}/README.rst", f"./readme_translations/{i}.rst"])
-        actions.append(["rm", "-rf", f"./.cache/{i}"])
-    actions.append(["rm", "-rf", "./.cache/source"])
-
-    return {
-        "actions": actions,
+    yield {
+        "name": "mo",
+        "actions": [["msgfmt", source, "-o", dest] for source, dest in zip(sources, dests)],
         "targets": dests,
         "file_dep": sources,
         "task_dep": ['crowdin', 'crowdin_pull']
     }
 
+    # One sub-task per language, so that READMEs can be built in parallel
+    # with ``doit -n``.
+    locale_dirs = (Path('.') / "readme_translations" / "locale").absolute()
+    for i in languages:
+        source_dir = f"./.cache/source_{i}"
+        yield {
+            "name": i,
+            "actions": [
+                ["mkdir", "-p", source_dir],
+                ["cp", README_BASE, f"{source_dir}/README.rst"],
+                ["sphinx-build", "-E", "-b", "rst", "-C",
+                 "-D", f"language={i}", "-D", f"locale_dirs={locale_dirs}",
+                 "-D", "extensions=sphinxcontrib.restbuilder",
+                 "-D", "master_doc=README", source_dir, f"./.cache/{i}"],
+                ["mv", f"./.cache/{i}/README.rst", f"./readme_translations/{i}.rst"],
+                ["rm", "-rf", f"./.cache/{i}", source_dir],
+            ],
+            "targets": [f"./readme_translations/{i}.rst"],
+            "file_dep": sources,
+            "task_dep": ['msgfmt:mo']
+        }
+
 
 def task_crowdin():
-    sources = glob.glob(f"./{PACKAGE}/**/*.po", recursive=True)
     return {
         "actions": ["crowdin upload sources"],
-        "file_dep": sources,
+        "file_dep": list(PO_SOURCES),
         "task_dep": ["gettext"]
     }
 
@@ -131,14 +144,12 @@ def task_mypy():
 
 
 def task_test():
-    sources = glob.glob(f"./{PACKAGE}/**/*.py", recursive=True)
-    sources = [i for i in sources if "__version__.py" not in i]
     return {
         "actions": [
             f"coverage run --source ./{PACKAGE} -m pytest",
             "coverage report"
         ],
-        "file_dep": sources
+        "file_dep": list(PY_SOURCES)
     }
 
 
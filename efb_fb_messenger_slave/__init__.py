@@ -2,12 +2,13 @@
 
 import logging
 import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from gettext import translation
 from io import BytesIO
 from typing import Optional, List, Dict, Any, Tuple, BinaryIO, Callable, cast
 
-import requests
-import yaml
 from fbchat import FBchatUserError, ThreadLocation, MessageReaction, FBchatException, Message
 from fbchat.models import Thread
 from pkg_resources import resource_filename
@@ -23,12 +24,25 @@ from ehforwarderbot.utils import extra
 from . import utils as efms_utils
 from .__version__ import __version__
 from .efms_chat import EFMSChatManager
-from .efms_client import EFMSClient
+from .efms_client import EFMSClient, SESSION
 from .extra_functions import ExtraFunctionsManager
 from .master_messages import MasterMessageManager
 from .utils import ExperimentalFlagsManager
 
 
+# Monkey patching: compare fbchat threads by ID
+def _thread_eq(a: Thread, b: Thread) -> bool:
+    return a.uid == b.uid
+
+
+def _thread_hash(self: Thread) -> int:
+    return hash(self.uid)
+
+
+Thread.__eq__ = _thread_eq  # type: ignore
+Thread.__hash__ = _thread_hash  # type: ignore
+
+
 class FBMessengerChannel(SlaveChannel):
     channel_name: str = "Facebook Messenger Slave"
     channel_emoji: str = "⚡️"
@@ -47,7 +61,7 @@ class FBMessengerChannel(SlaveChannel):
                            MessageReaction.ANGRY.value,
                            MessageReaction.YES.value,
                            MessageReaction.NO.value]
-    supported_message_types = MasterMessageManager.supported_message_types
+    supported_message_types = MasterMessageManager.supported_message_types  # type: ignore
 
     # Translator
     translator = translation("efb_fb_messenger_slave",
@@ -57,11 +71,17 @@ class FBMessengerChannel(SlaveChannel):
     _: Callable = translator.gettext
     ngettext: Callable = translator.ngettext
 
+    PICTURE_URL_CACHE_TTL = 60 * 60
+    """Number of seconds to reuse a chat picture URL looked up from server."""
+
     def __init__(self, instance_id: InstanceID = None):
         super().__init__(instance_id)
+        # Mapping of chat ID to chat picture URL and the time it is looked up.
+        self.picture_url_cache: Dict[str, Tuple[str, float]] = dict()
         session_path = efb_utils.get_data_path(self.channel_id) / "session.pickle"
         try:
-            data = pickle.load(session_path.open('rb'))
+            with session_path.open('rb') as f:
+                data = pickle.loads(f.read())
             self.client = EFMSClient(self, None, None, session_cookies=data)
         except FileNotFoundError:
             raise EFBException(self._("Session not found, please authorize your account.\n"
@@ -81,21 +101,26 @@ class FBMessengerChannel(SlaveChannel):
         # Initialize list of chat from server
         self.get_chats()
 
-        # Monkey patching
-        Thread.__eq__ = lambda a, b: a.uid == b.uid
-
     def load_config(self):
         """
         Load configuration from path specified by the framework.
 
         Configuration file is in YAML format.
         """
+        # Imported here as it is only needed once at start up.
+        import yaml
+        try:
+            from yaml import CSafeLoader as YAMLLoader
+        except ImportError:
+            from yaml import SafeLoader as YAMLLoader  # type: ignore
+
         config_path = efb_utils.get_config_path(self.channel_id)
         if not config_path.exists():
             self.config: Dict[str, Any] = dict()
             return
-        with config_path.open() as f:
-            self.config: Dict[str, Any] = yaml.full_load(f) or dict()
+        # libyaml reads bytes directly, skipping the text decoding layer.
+        with config_path.open('rb') as f:
+            self.config: Dict[str, Any] = yaml.load(f, Loader=YAMLLoader) or dict()
 
     def get_chats(self) -> List[Chat]:
         locations: Tuple[ThreadLocation, ...] = (ThreadLocation.INBOX,)
@@ -103,13 +128,15 @@ class FBMessengerChannel(SlaveChannel):
             locations += (ThreadLocation.PENDING, ThreadLocation.OTHER)
         if self.flag('show_archived_threads'):
             locations += (ThreadLocation.ARCHIVED,)
-        chats: List[Chat] = []
-        for i in self.client.fetchThreadList(thread_location=locations):
-            chats.append(self.chat_manager.build_and_cache_thread(i))
-        loaded_chats = set(i.uid for i in chats)
-        for i in self.client.fetchAllUsers():
-            if i.uid not in loaded_chats:
-                chats.append(self.chat_manager.build_and_cache_thread(i))
+        # Thread list and user list are independent requests
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            threads_future = executor.submit(self.client.fetchThreadList, thread_location=locations)
+            users_future = executor.submit(self.client.fetchAllUsers)
+            threads, users = threads_future.result(), users_future.result()
+        build = self.chat_manager.build_and_cache_thread
+        chats: List[Chat] = [build(i) for i in threads]
+        loaded_chats = {i.uid for i in chats}
+        chats.extend(build(i) for i in users if i.uid not in loaded_chats)
         return chats
 
     def get_chat(self, chat_uid: str) -> Chat:
@@ -143,22 +170,33 @@ class FBMessengerChannel(SlaveChannel):
 
     def stop_polling(self):
         self.client.listening = False
+        self.master_message.flush_mark_as_read()
 
     def get_chat_picture(self, chat: Chat) -> BinaryIO:
         self.logger.debug("Getting picture of chat %s", chat)
         photo_url = chat.vendor_specific.get('profile_picture_url')
         self.logger.debug("[%s] has photo_url from cache: %s", chat.uid, photo_url)
+        if not photo_url and chat.uid in self.picture_url_cache:
+            cached_url, fetched_at = self.picture_url_cache[chat.uid]
+            if time.monotonic() - fetched_at < self.PICTURE_URL_CACHE_TTL:
+                photo_url = cached_url
+                self.logger.debug("[%s] has photo_url from picture URL cache: %s", chat.uid, photo_url)
         if not photo_url:
             thread = self.client.get_thread_info(chat.uid)
             photo_url = efms_utils.get_value(thread, ('messaging_actor', 'big_image_src', 'uri'))
-        self.logger.debug("[%s] has photo_url from GraphQL: %s", chat.uid, photo_url)
-        if not photo_url:
-            thread = self.client.fetchThreadInfo(chat.uid)[chat.uid]
-            photo_url = getattr(thread, 'photo', None)
-        self.logger.debug("[%s] has photo_url from legacy API: %s", chat.uid, photo_url)
+            self.logger.debug("[%s] has photo_url from GraphQL: %s", chat.uid, photo_url)
+            if not photo_url:
+                thread = self.client.fetchThreadInfo(chat.uid)[chat.uid]
+                photo_url = getattr(thread, 'photo', None)
+                self.logger.debug("[%s] has photo_url from legacy API: %s", chat.uid, photo_url)
+            if photo_url:
+                self.picture_url_cache[chat.uid] = (photo_url, time.monotonic())
         if not photo_url:
             raise EFBOperationNotSupported('This chat has no picture.')
-        photo = BytesIO(requests.get(photo_url).content)
+        photo = BytesIO()
+        with SESSION.get(photo_url, stream=True) as response:
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, photo, 1 << 14)
         photo.seek(0)
         return photo
 
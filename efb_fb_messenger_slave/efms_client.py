@@ -2,19 +2,26 @@
 
 import logging
 import copy
+import functools
+import io
 import os
 import re
+import shutil
 import urllib.parse
 import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Dict, Tuple, Set, List, DefaultDict, cast, Collection
+from typing import TYPE_CHECKING, Any, Dict, Tuple, List, DefaultDict, cast, Collection, Optional, BinaryIO, Callable, \
+    Mapping
 from tempfile import NamedTemporaryFile
+from types import MappingProxyType
 
 import requests
-from fbchat import Client, _graphql
-from fbchat._exception import FBchatException, FBchatUserError
+from requests.adapters import HTTPAdapter
+from fbchat import Client, _graphql, _util
+from fbchat._exception import FBchatException, FBchatUserError, FBchatPleaseRefresh
 from fbchat._thread import ThreadType, ThreadLocation, Thread
 from fbchat.models import Message, EmojiSize, Group, User
 from ehforwarderbot import MsgType, coordinator
@@ -26,17 +33,113 @@ from ehforwarderbot.types import MessageID, ReactionName, ChatID
 
 from .utils import get_value, PahoMQTTPingFilter
 
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
 if TYPE_CHECKING:
     from . import FBMessengerChannel
 
+SESSION = requests.Session()
+"""HTTP session shared by media downloads, reusing connections to Facebook CDN."""
+SESSION.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+SESSION.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+DOWNLOAD_WORKERS = 8
+"""Maximum number of attachments of a message downloaded at the same time."""
+
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+"""Size of chunks to write when streaming a download to disk."""
+
+STREAMING_UPLOAD_MIN_SIZE = 1 << 20
+"""In-memory files smaller than this many bytes are uploaded without streaming."""
+
+_MISSING = object()
+"""Sentinel for absent dict entries."""
+
+EMOJI_SIZE_BY_STICKER_ID: Dict[str, EmojiSize] = {i.value: i for i in EmojiSize}
+"""Sizes of the "Like" sticker indexed by sticker ID."""
+
+STICKER_MIME_TYPES: Dict[str, str] = {
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+"""MIME types of stickers by file extension."""
+
+SAFE_IMAGE_URL_PATTERN = re.compile(r'[?&]url=([^&#]+)')
+LINK_SHIM_URL_PATTERN = re.compile(r'[?&]u=([^&#]+)')
+LOCATION_MARKER_PATTERN = re.compile(r'markers=([\d.-]+)%2C([\d.-]+)')
+
+
+def download_to_tempfile(url: str, suffix: str) -> Tuple[BinaryIO, Optional[str]]:
+    """
+    Stream a remote file into a temporary file without holding
+    the entire body in memory.
+
+    Args:
+        url: URL of the file
+        suffix: Suffix of the temporary file
+
+    Returns:
+        The temporary file, seeked to the start, and the MIME type
+        reported by the server.
+    """
+    file = NamedTemporaryFile(suffix=suffix)
+    try:
+        with SESSION.get(url, stream=True) as response:
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, file, DOWNLOAD_CHUNK_SIZE)
+            mime = response.headers.get('content-type')
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return cast(BinaryIO, file), mime
+
+
+def is_small_buffer(file: Any) -> bool:
+    """Check if a file is an in-memory buffer smaller than :data:`STREAMING_UPLOAD_MIN_SIZE`."""
+    return isinstance(file, io.BytesIO) and file.getbuffer().nbytes < STREAMING_UPLOAD_MIN_SIZE
+
+
+@functools.lru_cache(maxsize=2048)
+def unwrap_facebook_url(url: str) -> str:
+    """Extract the original URL from a Facebook-proxied URL."""
+    if 'safe_image.php' in url:
+        match = SAFE_IMAGE_URL_PATTERN.search(url)
+    elif 'l.facebook.com/l.php' in url:
+        match = LINK_SHIM_URL_PATTERN.search(url)
+    else:
+        return url
+    if match is None:
+        return url
+    return urllib.parse.unquote_plus(match.group(1))
+
 
 class EFMSClient(Client):
     channel: 'FBMessengerChannel'
 
     logger = logging.getLogger("EFMSClient")
 
-    sent_messages: Set[str] = set()
-    """Set of messages IDs sent by EFMS, popped when message is received again."""
+    sent_messages: 'OrderedDict[str, None]'
+    """Messages IDs sent by EFMS, popped when message is received again."""
+
+    SENT_MESSAGES_LIMIT = 4096
+    """Maximum number of sent message IDs to remember."""
+
+    # Constant GraphQL query parameters
+    THREAD_LIST_PARAMS: Mapping[str, Any] = MappingProxyType({
+        'includeDeliveryReceipts': True,
+        'includeSeqID': False,
+    })
+    THREAD_INFO_PARAMS: Mapping[str, Any] = MappingProxyType({
+        'message_limit': 0,
+        'load_message': 0,
+        'load_read_receipt': False,
+        'before': None,
+    })
 
     # Overrides for patches
 
@@ -51,6 +154,8 @@ class EFMSClient(Client):
         # Used when messages recalls from FB server
         self.message_mappings: Dict[str, int] = dict()
 
+        self.sent_messages = OrderedDict()
+
         # Suppress ping logs from paho.mqtt.client
         logging.getLogger("paho.mqtt.client").addFilter(PahoMQTTPingFilter())
         super().__init__(*args, **kwargs)
@@ -94,13 +199,9 @@ class EFMSClient(Client):
                         location_obj: Tuple[ThreadLocation, ...] = (ThreadLocation.INBOX,)):
         location = list(i.name for i in location_obj)
 
-        j = self.graphql_request(_graphql.from_doc_id(doc_id='1349387578499440', params={
-            'limit': limit,
-            'tags': location,
-            'includeDeliveryReceipts': True,
-            'includeSeqID': False,
-            'before': before
-        }))
+        params = dict(self.THREAD_LIST_PARAMS)
+        params.update(limit=limit, tags=location, before=before)
+        j = self.graphql_request(_graphql.from_doc_id(doc_id='1349387578499440', params=params))
 
         if j.get('viewer') is None:
             raise FBchatException('Could not fetch thread list: {}'.format(j))
@@ -108,35 +209,27 @@ class EFMSClient(Client):
         return j['viewer']['message_threads']['nodes']
 
     def get_thread_info(self, tid: str):
-        j = self.graphql_request(_graphql.from_doc_id(doc_id='1508526735892416', params={
-            'id': tid,
-            'message_limit': 0,
-            'load_message': 0,
-            'load_read_receipt': False,
-            'before': None,
-        }))
+        params = dict(self.THREAD_INFO_PARAMS)
+        params['id'] = tid
+        j = self.graphql_request(_graphql.from_doc_id(doc_id='1508526735892416', params=params))
 
         if j.get('message_thread') is None:
             raise FBchatException('Could not fetch thread list: {}'.format(j))
 
         return j['message_thread']
 
-    def process_url(self, url: str, override: bool = False) -> str:
-        """Unwrap Facebook-proxied URL if necessary."""
-        if not url:
-            return url
-        if not override and self.channel.flag('proxy_links_by_facebook'):
-            return url
-        if 'safe_image.php' in url:
-            query = urllib.parse.urlparse(url).query
-            escaped = urllib.parse.parse_qs(query).get('url', [url])[0]
-            return escaped
-        elif 'l.facebook.com/l.php' in url:
-            query = urllib.parse.urlparse(url).query
-            escaped = urllib.parse.parse_qs(query).get('u', [url])[0]
-            return escaped
-        else:
+    def process_url(self, url: str, proxy: bool = False) -> str:
+        """
+        Unwrap Facebook-proxied URL if necessary.
+
+        Args:
+            url: URL to process
+            proxy: Keep the URL proxied by Facebook, usually
+                the value of flag ``proxy_links_by_facebook``.
+        """
+        if not url or proxy:
             return url
+        return unwrap_facebook_url(url)
 
     def attach_msg_type(self, msg: Message, attachment: Dict[str, Any]):
         """
@@ -183,10 +276,11 @@ class EFMSClient(Client):
                 get_value(link_information, ('media', 'is_playable'), False) else None
             preview = preview or get_value(link_information, ('media', 'image', 'uri'), None)
             url = link_information['media'].get('url', preview)
+            proxy = self.channel.flag('proxy_links_by_facebook')
             msg.attributes = LinkAttribute(title=title,
                                            description=description,
-                                           image=self.process_url(preview),
-                                           url=self.process_url(url))
+                                           image=self.process_url(preview, proxy),
+                                           url=self.process_url(url, proxy))
         elif attachment_type == 'MessageLocation':
             msg.type = MsgType.Location
             link_information = get_value(attachment, ('mercury', 'extensible_attachment', 'story_attachment'), {})
@@ -194,19 +288,19 @@ class EFMSClient(Client):
             description = get_value(link_information, ('description', 'text'), '')
             msg.text = '\n'.join([title, description])
             preview = get_value(link_information, ('media', 'image', 'uri'), None)
-            matches = re.search(r'markers=([\d.-]+)%2C([\d.-]+)', preview)
+            matches = preview and LOCATION_MARKER_PATTERN.search(preview)
             if matches:
-                latitude, longitude = map(float, matches.groups())
+                latitude, longitude = float(matches.group(1)), float(matches.group(2))
             else:
                 msg.type = MsgType.Unsupported
-                msg.text = self._("Message type unsupported.\n{content}").format(msg.text)
+                msg.text = self._("Message type unsupported.\n{content}").format(content=msg.text)
                 return
             msg.attributes = LocationAttribute(
                 latitude=latitude, longitude=longitude
             )
         else:
             msg.type = MsgType.Unsupported
-            msg.text = self._("Message type unsupported.\n{content}").format(msg.text)
+            msg.text = self._("Message type unsupported.\n{content}").format(content=msg.text)
 
     def attach_media(self, msg: Message, attachment: Dict[str, Any]):
         """
@@ -218,6 +312,23 @@ class EFMSClient(Client):
                 Dict of information of the attachment
                 ``fbchat`` entity is not used as it is not completed.
         """
+        url = self._resolve_attachment(msg, attachment)
+        if url:
+            self._download_attachment(msg, url)
+
+    def _resolve_attachment(self, msg: EFBMessage, attachment: Dict[str, Any]) -> Optional[str]:
+        """
+        Fill in details of a message from its attachment without
+        downloading the attached file.
+
+        Args:
+            msg: Message to be attached to
+            attachment: Dict of information of the attachment
+
+        Returns:
+            URL of the file to be downloaded, or ``None`` if the
+            attachment has no file.
+        """
         self.logger.debug("[%s] Trying to attach media: %s", msg.uid, attachment)
 
         blob_attachment: Dict[str, Any] = attachment.get('mercury', {}).get('blob_attachment', {})
@@ -237,121 +348,144 @@ class EFMSClient(Client):
 
         msg.filename = attachment.get('filename', None)
         msg.mime = attachment.get('mimeType', None)
-        if attachment_type == "MessageAudio":
-            msg.type = MsgType.Voice
-            msg.filename = msg.filename or 'audio.mp3'
-            msg.mime = msg.mime or 'audio/mpeg'
-            ext = os.path.splitext(msg.filename)[1]
-            msg.file = NamedTemporaryFile(suffix=ext)
-            msg.file.write(requests.get(blob_attachment['playable_url']).content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == 'MessageImage':
-            msg.type = MsgType.Image
-            msg.filename = msg.filename or 'image.png'
-            msg.mime = msg.mime or 'image/png'
-            attribution_app = get_value(blob_attachment, ('attribution_app', 'name'))
-            if attribution_app:
-                if msg.text:
-                    msg.text += " (via %s)" % attribution_app
-                else:
-                    msg.text = "via %s" % attribution_app
-            ext = os.path.splitext(msg.filename)[1]
-            msg.file = NamedTemporaryFile(suffix=ext)
-            url = self.fetchImageUrl(attachment['id'])
-            msg.file.write(requests.get(url).content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == 'MessageAnimatedImage':
-            msg.type = MsgType.Animation
-            msg.filename = msg.filename or 'image.gif'
-            msg.mime = msg.mime or 'image/gif'
-            ext = os.path.splitext(msg.filename)[1]
-            msg.file = NamedTemporaryFile(suffix=ext)
-            msg.file.write(requests.get(blob_attachment['animated_image']['uri'], allow_redirects=True).content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == 'MessageFile':
-            msg.type = MsgType.File
-            msg.filename = msg.filename or 'file'
-            msg.mime = msg.mime or 'application/octet-stream'
-            ext = os.path.splitext(msg.filename)[1]
-            msg.file = NamedTemporaryFile(suffix=ext)
-            msg.file.write(requests.get(self.process_url(blob_attachment['url'], True), allow_redirects=True).content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == 'MessageVideo':
-            msg.type = MsgType.Image
-            msg.filename = msg.filename or 'video.mp4'
-            msg.mime = msg.mime or 'video/mpeg'
-            ext = os.path.splitext(msg.filename)[1]
-            msg.file = NamedTemporaryFile(suffix=ext)
-            msg.file.write(requests.get(blob_attachment['playable_url'], allow_redirects=True).content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == '__Sticker':
-            if get_value(attachment, ('mercury', 'sticker_attachment', 'pack', 'id')) == "227877430692340":
-                self.logger.debug("[%s] Sticker received is a \"Like\" sticker. Converting message to text.", msg.uid)
-
-                sticker_id = get_value(attachment, ('mercury', 'sticker_attachment', 'id'))
-                for i in EmojiSize:
-                    if sticker_id == i.value:
-                        msg.type = MsgType.Text
-                        msg.text = "👍 (%s)" % i.name[0]
-                        return
-            msg.type = MsgType.Sticker
-            url = attachment['mercury']['sticker_attachment']['url']
-            msg.text = attachment['mercury']['sticker_attachment'].get('label', '')
-            filename = os.path.split(urllib.parse.urlparse(url).path)[1]
-            msg.filename = filename
-            ext = os.path.splitext(filename)[1]
-            response = requests.get(url)
-            msg.mime = response.headers['content-type']
-            msg.file = NamedTemporaryFile(suffix=ext)
-            msg.file.write(response.content)
-            msg.file.seek(0)
-            msg.path = Path(msg.file.name)
-        elif attachment_type == '__Link':
-            msg.type = MsgType.Link
-            link_information = get_value(attachment, ('mercury', 'extensible_attachment', 'story_attachment'), {})
-            title = get_value(link_information, ('title_with_entities', 'text'), '')
-            description = get_value(link_information, ('description', 'text'), '')
-            source = get_value(link_information, ('source', 'text'), None)
-            if source:
-                description += " (via %s)" % source
-            preview = get_value(link_information, ('media', 'playable_url'), None) if \
-                get_value(link_information, ('media', 'is_playable'), False) else None
-            preview = preview or get_value(link_information, ('media', 'image', 'uri'), None)
-            url = link_information.get('url', preview)
-            msg.attributes = LinkAttribute(title=title,
-                                           description=description,
-                                           image=self.process_url(preview),
-                                           url=self.process_url(url))
-        elif attachment_type == 'MessageLocation':
-            msg.type = MsgType.Location
-            link_information = get_value(attachment, ('mercury', 'extensible_attachment', 'story_attachment'), {})
-            title = get_value(link_information, ('title_with_entities', 'text'), '')
-            description = get_value(link_information, ('description', 'text'), '')
-            msg.text = '\n'.join([title, description])
-            preview = get_value(link_information, ('media', 'image', 'uri'), None)
-            matches = re.search(r'markers=([\d.-]+)%2C([\d.-]+)', preview)
-            if matches:
-                latitude, longitude = map(float, matches.groups())
+        handler = self.ATTACHMENT_HANDLERS.get(attachment_type, EFMSClient._attach_unsupported)
+        return handler(self, msg, attachment, blob_attachment)
+
+    def _attach_audio(self, msg: EFBMessage, attachment: Dict[str, Any],
+                      blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Voice
+        msg.filename = msg.filename or 'audio.mp3'
+        msg.mime = msg.mime or 'audio/mpeg'
+        return blob_attachment['playable_url']
+
+    def _attach_image(self, msg: EFBMessage, attachment: Dict[str, Any],
+                      blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Image
+        msg.filename = msg.filename or 'image.png'
+        msg.mime = msg.mime or 'image/png'
+        attribution_app = get_value(blob_attachment, ('attribution_app', 'name'))
+        if attribution_app:
+            if msg.text:
+                msg.text += " (via %s)" % attribution_app
             else:
-                msg.type = MsgType.Unsupported
-                msg.text = self._("Message type unsupported.\n{content}").format(msg.text)
-                return
-            msg.attributes = LocationAttribute(
-                latitude=latitude, longitude=longitude
-            )
-        else:
-            msg.type = MsgType.Unsupported
-            msg.text = self._("Message type unsupported.\n{content}").format(msg.text)
+                msg.text = "via %s" % attribution_app
+        return self.fetchImageUrl(attachment['id'])
+
+    def _attach_animated_image(self, msg: EFBMessage, attachment: Dict[str, Any],
+                               blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Animation
+        msg.filename = msg.filename or 'image.gif'
+        msg.mime = msg.mime or 'image/gif'
+        return blob_attachment['animated_image']['uri']
+
+    def _attach_file(self, msg: EFBMessage, attachment: Dict[str, Any],
+                     blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.File
+        msg.filename = msg.filename or 'file'
+        msg.mime = msg.mime or 'application/octet-stream'
+        return self.process_url(blob_attachment['url'])
+
+    def _attach_video(self, msg: EFBMessage, attachment: Dict[str, Any],
+                      blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Image
+        msg.filename = msg.filename or 'video.mp4'
+        msg.mime = msg.mime or 'video/mpeg'
+        return blob_attachment['playable_url']
+
+    def _attach_sticker(self, msg: EFBMessage, attachment: Dict[str, Any],
+                        blob_attachment: Dict[str, Any]) -> Optional[str]:
+        if get_value(attachment, ('mercury', 'sticker_attachment', 'pack', 'id')) == "227877430692340":
+            self.logger.debug("[%s] Sticker received is a \"Like\" sticker. Converting message to text.", msg.uid)
+
+            sticker_id = get_value(attachment, ('mercury', 'sticker_attachment', 'id'))
+            size = EMOJI_SIZE_BY_STICKER_ID.get(sticker_id)
+            if size is not None:
+                msg.type = MsgType.Text
+                msg.text = "👍 (%s)" % size.name[0]
+                return None
+        msg.type = MsgType.Sticker
+        url = attachment['mercury']['sticker_attachment']['url']
+        msg.text = attachment['mercury']['sticker_attachment'].get('label', '')
+        filename = os.path.split(urllib.parse.urlparse(url).path)[1]
+        msg.filename = filename
+        # Fall back to the MIME type in the download response for unknown extensions
+        msg.mime = STICKER_MIME_TYPES.get(os.path.splitext(filename)[1].lower())
+        return url
+
+    def _attach_link(self, msg: EFBMessage, attachment: Dict[str, Any],
+                     blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Link
+        link_information = get_value(attachment, ('mercury', 'extensible_attachment', 'story_attachment'), {})
+        title = get_value(link_information, ('title_with_entities', 'text'), '')
+        description = get_value(link_information, ('description', 'text'), '')
+        source = get_value(link_information, ('source', 'text'), None)
+        if source:
+            description += " (via %s)" % source
+        preview = get_value(link_information, ('media', 'playable_url'), None) if \
+            get_value(link_information, ('media', 'is_playable'), False) else None
+        preview = preview or get_value(link_information, ('media', 'image', 'uri'), None)
+        url = link_information.get('url', preview)
+        proxy = self.channel.flag('proxy_links_by_facebook')
+        msg.attributes = LinkAttribute(title=title,
+                                       description=description,
+                                       image=self.process_url(preview, proxy),
+                                       url=self.process_url(url, proxy))
+        return None
+
+    def _attach_location(self, msg: EFBMessage, attachment: Dict[str, Any],
+                         blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Location
+        link_information = get_value(attachment, ('mercury', 'extensible_attachment', 'story_attachment'), {})
+        title = get_value(link_information, ('title_with_entities', 'text'), '')
+        description = get_value(link_information, ('description', 'text'), '')
+        msg.text = '\n'.join([title, description])
+        preview = get_value(link_information, ('media', 'image', 'uri'), None)
+        matches = preview and LOCATION_MARKER_PATTERN.search(preview)
+        if not matches:
+            return self._attach_unsupported(msg, attachment, blob_attachment)
+        msg.attributes = LocationAttribute(
+            latitude=float(matches.group(1)), longitude=float(matches.group(2))
+        )
+        return None
+
+    def _attach_unsupported(self, msg: EFBMessage, attachment: Dict[str, Any],
+                            blob_attachment: Dict[str, Any]) -> Optional[str]:
+        msg.type = MsgType.Unsupported
+        msg.text = self._("Message type unsupported.\n{content}").format(content=msg.text)
+        return None
+
+    ATTACHMENT_HANDLERS: Dict[str, Callable[['EFMSClient', EFBMessage, Dict[str, Any], Dict[str, Any]],
+                                            Optional[str]]] = {
+        'MessageAudio': _attach_audio,
+        'MessageImage': _attach_image,
+        'MessageAnimatedImage': _attach_animated_image,
+        'MessageFile': _attach_file,
+        'MessageVideo': _attach_video,
+        '__Sticker': _attach_sticker,
+        '__Link': _attach_link,
+        'MessageLocation': _attach_location,
+    }
+    """Handlers filling in a message by attachment type, returning URL of the file to download."""
+
+    def _download_attachment(self, msg: EFBMessage, url: str):
+        """Download the file of an attachment to the message."""
+        ext = os.path.splitext(msg.filename or '')[1]
+        file, mime = download_to_tempfile(url, ext)
+        msg.file = file
+        msg.mime = msg.mime or mime
+        msg.path = Path(file.name)
+
+    def add_sent_message(self, message_id: str):
+        """Remember a message sent by EFMS, forgetting the oldest ones beyond the limit."""
+        self.sent_messages[message_id] = None
+        self.sent_messages.move_to_end(message_id)
+        if len(self.sent_messages) > self.SENT_MESSAGES_LIMIT:
+            self.sent_messages.popitem(last=False)
 
     def send(self, *args, **kwargs):
         result = super().send(*args, **kwargs)
         if result.startswith('mid.$'):
-            self.sent_messages.add(result)
+            self.add_sent_message(result)
         return result
 
     # Triggers
@@ -381,8 +515,8 @@ class EFMSClient(Client):
         # Ignore messages sent by EFMS
         time.sleep(0.25)
 
-        if mid in self.sent_messages:
-            self.sent_messages.remove(mid)
+        # Test and remove in one step, as the oldest IDs may be evicted concurrently
+        if self.sent_messages.pop(mid, _MISSING) is not _MISSING:
             return
 
         self.logger.debug("[%s] Received message from Messenger: %s", mid, message_object)
@@ -395,11 +529,27 @@ class EFMSClient(Client):
             self.logger.debug("[%s] Multiple attachments detected. Splitting into %s messages.",
                               mid, len(attachments))
             self.message_mappings[mid] = len(attachments)
-            for idx, i in enumerate(attachments):
-                sub_msg = copy.copy(efb_msg)
-                sub_msg.uid = MessageID(f"{efb_msg.uid}.{idx}")
-                self.attach_media(sub_msg, i)
+            sub_msgs: List[EFBMessage] = [copy.copy(efb_msg) for _ in attachments]
+            urls: List[Optional[str]] = []
+            for idx, (sub_msg, i) in enumerate(zip(sub_msgs, attachments)):
+                sub_msg.uid = MessageID(f"{mid}.{idx}")
+                urls.append(self._resolve_attachment(sub_msg, i))
+            # Download files of all attachments concurrently
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                futures = {executor.submit(self._download_attachment, sub_msg, url): sub_msg
+                           for sub_msg, url in zip(sub_msgs, urls) if url}
+                for future in as_completed(futures):
+                    sub_msg = futures[future]
+                    try:
+                        future.result()
+                    except (requests.RequestException, OSError):
+                        # Deliver the other attachments regardless
+                        self.logger.exception("[%s] Failed to download attachment.", sub_msg.uid)
+                        sub_msg.file = sub_msg.path = sub_msg.filename = sub_msg.mime = None
+                        self._attach_unsupported(sub_msg, {}, {})
+            for sub_msg in sub_msgs:
                 coordinator.send_message(sub_msg)
+            self.markAsDelivered(thread_id, mid)
             return
 
         if attachments:
@@ -407,7 +557,7 @@ class EFMSClient(Client):
 
         coordinator.send_message(efb_msg)
 
-        self.markAsDelivered(mid, thread_id)
+        self.markAsDelivered(thread_id, mid)
 
     def build_efb_msg(self, mid: str, thread_id: str, author_id: str, message_object: Message,
                       nested: bool = False) -> EFBMessage:
@@ -430,9 +580,12 @@ class EFMSClient(Client):
                                                 nested=True)
 
         if message_object.mentions:
-            mentions: Dict[Tuple[int, int], ChatMember] = dict()
-            for i in message_object.mentions:
-                mentions[(i.offset, i.offset + i.length)] = efb_msg.chat.get_member(i.thread_id)
+            # Index members once instead of scanning the member list per mention
+            members: Dict[str, ChatMember] = {i.uid: i for i in efb_msg.chat.members}
+            mentions: Dict[Tuple[int, int], ChatMember] = {
+                (i.offset, i.offset + i.length): members[i.thread_id]
+                for i in message_object.mentions
+            }
             efb_msg.substitutions = Substitutions(mentions)
 
         if message_object.emoji_size:
@@ -486,13 +639,8 @@ class EFMSClient(Client):
         if limit > 20 or limit < 1:
             raise FBchatUserError("`limit` should be between 1 and 20")
 
-        params = {
-            "limit": limit,
-            "tags": [i.value for i in thread_location],
-            "before": before,
-            "includeDeliveryReceipts": True,
-            "includeSeqID": False,
-        }
+        params = dict(self.THREAD_LIST_PARAMS)
+        params.update(limit=limit, tags=[i.value for i in thread_location], before=before)
         (j,) = self.graphql_requests(_graphql.from_doc_id("1349387578499440", params))
 
         rtn = []
@@ -509,6 +657,52 @@ class EFMSClient(Client):
                 self.logger.error("Unknown thread type: %s, %s", _type, node)
         return rtn
 
+    def _upload(self, files, voice_clip=False):
+        """Upload files to Facebook.
+
+        `files` should be a list of ``(filename, file, mimetype)`` tuples.
+
+        Return a list of tuples with a file's ID and mimetype.
+
+        Notes:
+            Modified based on fbchat 1.9.7. When ``requests_toolbelt``
+            is installed, the request body is streamed from the files
+            instead of being built in memory as a whole, unless all
+            files are small in-memory buffers.
+        """
+        # MOD: Fall back to buffered upload
+        if MultipartEncoder is None or all(is_small_buffer(file) for _, file, _ in files):
+            return super()._upload(files, voice_clip=voice_clip)
+
+        data = {"voice_clip": voice_clip}
+        data.update(self._state.get_params())
+        fields = [(key, str(value)) for key, value in data.items()]
+        fields.extend(("upload_{}".format(i), f) for i, f in enumerate(files))
+        encoder = MultipartEncoder(fields)
+
+        r = self._state._session.post("https://upload.facebook.com/ajax/mercury/upload.php",
+                                      data=encoder, headers={"Content-Type": encoder.content_type})
+        j = _util.to_json(_util.check_request(r))
+        try:
+            _util.handle_payload_error(j)
+        except FBchatPleaseRefresh:
+            # MOD: Streamed body cannot be replayed, retry with fbchat's own path
+            for _, file, _ in files:
+                file.seek(0)
+            return super()._upload(files, voice_clip=voice_clip)
+
+        try:
+            metadata = j["payload"]["metadata"]
+        except (KeyError, TypeError):
+            raise FBchatException("Missing payload: {}".format(j))
+        if len(metadata) != len(files):
+            raise FBchatException("Some files could not be uploaded: {}, {}".format(j, files))
+
+        return [
+            (item[_util.mimetype_to_key(item["filetype"])], item["filetype"])
+            for item in metadata
+        ]
+
     # region [Callbacks]
 
     def onReactionAdded(self, mid=None, reaction=None, author_id=None, thread_id=None, thread_type=None, ts=None,
@@ -3,15 +3,18 @@
 import logging
 import threading
 import time
-from typing import TYPE_CHECKING, Tuple, List
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Tuple, List, Dict, Callable, Optional
 
 import emoji
+from fbchat import FBchatException
 from fbchat.models import Thread, Message, TypingStatus, ThreadType, Mention, EmojiSize, Sticker, LocationAttachment
 
 from ehforwarderbot import MsgType
 from ehforwarderbot.message import Message as EFBMessage
 from ehforwarderbot.exceptions import EFBMessageTypeNotSupported
 from ehforwarderbot.message import LinkAttribute, StatusAttribute, LocationAttribute
+from ehforwarderbot.types import MessageID
 
 if TYPE_CHECKING:
     from . import FBMessengerChannel
@@ -23,24 +26,106 @@ class MasterMessageManager:
             self.value = reaction
 
     logger = logging.getLogger("MasterMessageManager")
-    supported_message_types = {MsgType.Text, MsgType.Image, MsgType.Sticker,
-                               MsgType.Voice, MsgType.File, MsgType.Video,
-                               MsgType.Status, MsgType.Unsupported,
-                               MsgType.Location, MsgType.Animation}
+
+    # ``EMOJI_DATA`` replaces ``UNICODE_EMOJI`` since emoji 1.7.
+    EMOJI_SET = frozenset(getattr(emoji, 'EMOJI_DATA', None) or emoji.UNICODE_EMOJI)  # type: ignore
+    """All emoji characters, used to detect messages of a sized emoji."""
+
+    EMOJI_SIZES = {
+        'S': EmojiSize.SMALL,
+        'M': EmojiSize.MEDIUM,
+        'L': EmojiSize.LARGE,
+    }
+    """Emoji sizes by the suffix of a sized emoji message."""
+
+    THUMBS_UP_STICKERS = {
+        "👍" + suffix: Sticker(uid=size.value)
+        for suffix, size in (('', EmojiSize.SMALL), *EMOJI_SIZES.items())
+    }
+    """Stickers of the thumbs-up "Like" by text of the message sent, with optional size suffix."""
+
+    THREAD_CACHE_LIMIT = 512
+    """Maximum number of chats to remember thread ID and type for."""
+
+    TYPING_STATUSES = frozenset({StatusAttribute.Types.TYPING,
+                                 StatusAttribute.Types.UPLOADING_VOICE,
+                                 StatusAttribute.Types.UPLOADING_VIDEO,
+                                 StatusAttribute.Types.UPLOADING_IMAGE,
+                                 StatusAttribute.Types.UPLOADING_FILE})
+    """Status types shown as typing in Messenger."""
+
+    MARK_AS_READ_DELAY = 0.1
+    """Seconds without new messages sent to a chat before marking it as read."""
+
+    supported_message_types = frozenset({MsgType.Text, MsgType.Image, MsgType.Sticker,
+                                         MsgType.Voice, MsgType.File, MsgType.Video,
+                                         MsgType.Status, MsgType.Unsupported,
+                                         MsgType.Location, MsgType.Animation})
 
     def __init__(self, channel: 'FBMessengerChannel'):
         self.channel = channel
         self.client = channel.client
         self.flag = channel.flag
+        # Flags are not changed after the channel is loaded
+        self.send_link_with_description: bool = bool(self.flag('send_link_with_description'))
+
+        # Mapping of chat ID to ID and type of its thread, least recently used first.
+        self.thread_cache: 'OrderedDict[str, Tuple[str, ThreadType]]' = OrderedDict()
+        self.thread_cache_lock = threading.Lock()
+
+        # Mapping of chat ID to time of the last message sent, for chats yet to be marked as read.
+        self.pending_read: Dict[str, float] = dict()
+        self.pending_read_lock = threading.Lock()
+        self.pending_read_timer: Optional[threading.Timer] = None
+
+        # Methods sending each type of messages to Facebook
+        self.senders: Dict[MsgType, Callable[[EFBMessage, Message, str, ThreadType], None]] = {
+            MsgType.Text: self._send_text,
+            MsgType.Unsupported: self._send_text,
+            MsgType.Image: self._send_image,
+            MsgType.Sticker: self._send_image,
+            MsgType.Animation: self._send_image,
+            MsgType.Voice: self._send_voice,
+            MsgType.File: self._send_file,
+            MsgType.Video: self._send_file,
+            MsgType.Status: self._send_status,
+            MsgType.Link: self._send_link,
+            MsgType.Location: self._send_location,
+        }
+
+    def resolve_thread(self, chat_uid: str) -> Tuple[str, ThreadType]:
+        """Get ID and type of the thread of a chat, fetching from server when not cached."""
+        with self.thread_cache_lock:
+            entry = self.thread_cache.get(chat_uid)
+            if entry is not None:
+                self.thread_cache.move_to_end(chat_uid)
+                return entry
+        thread: Thread = self.client.fetchThreadInfo(chat_uid)[chat_uid]
+        entry = (thread.uid, thread.type)
+        with self.thread_cache_lock:
+            self.thread_cache[chat_uid] = entry
+            if len(self.thread_cache) > self.THREAD_CACHE_LIMIT:
+                self.thread_cache.popitem(last=False)
+        return entry
 
     def send_message(self, msg: EFBMessage) -> Message:
-        self.logger.debug("Received message from master: %s", msg)
+        # Skip evaluating arguments of debug logs when they are discarded
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug("Received message from master: %s", msg)
 
+        chat_uid = str(msg.chat.uid)
         try:
-            target_msg_offset = 0
-            prefix = ""
+            # Fast path for plain text that cannot be a sticker, a sized emoji,
+            # a reply or contain mentions
+            text = msg.text
+            if msg.type == MsgType.Text and not msg.substitutions and not msg.target \
+                    and len(text) > 2 and text[-1] not in ('S', 'M', 'L', '\uFE0F'):
+                thread_uid, thread_type = self.resolve_thread(chat_uid)
+                msg.uid = self.client.send(Message(text=text), thread_id=thread_uid, thread_type=thread_type)
+                return msg
 
-            mentions = []
+            mentions: List[Mention] = []
 
             # Send message reaction
             # if msg.target and msg.text.startswith('r`') and \
@@ -56,111 +141,162 @@ class MasterMessageManager:
 
             # Message substitutions
             if msg.substitutions:
-                self.logger.debug("[%s] Message has substitutions: %s", msg.uid, msg.substitutions)
-                for i in msg.substitutions:
-                    mentions.append(Mention(msg.substitutions[i].id,
-                                            target_msg_offset + i[0], i[1] - i[0]))
-                self.logger.debug("[%s] Translated to mentions: %s", msg.uid, mentions)
-
-            fb_msg = Message(text=prefix + msg.text, mentions=mentions)
-            thread: Thread = self.client.fetchThreadInfo(msg.chat.uid)[str(msg.chat.uid)]
-
-            if msg.target and msg.target.uid:
-                fb_msg.reply_to_id = msg.target.uid
-
-            if msg.type in (MsgType.Text, MsgType.Unsupported):
-                # Remove variation selector-16 (force colored emoji) for
-                # matching.
-                emoji_compare = msg.text.replace("\uFE0F", "")
-                if emoji_compare == "👍":
-                    fb_msg.sticker = Sticker(uid=EmojiSize.SMALL.value)
-                    if not prefix:
-                        fb_msg.text = None
-                elif emoji_compare[:-1] == "👍" and emoji_compare[-1] in 'SML':
-                    if emoji_compare[-1] == 'S':
-                        fb_msg.sticker = Sticker(uid=EmojiSize.SMALL.value)
-                    elif emoji_compare[-1] == 'M':
-                        fb_msg.sticker = Sticker(uid=EmojiSize.MEDIUM.value)
-                    elif emoji_compare[-1] == 'L':
-                        fb_msg.sticker = Sticker(uid=EmojiSize.LARGE.value)
-                    if not prefix:
-                        fb_msg.text = None
-                elif emoji_compare[:-1] in emoji.UNICODE_EMOJI and emoji_compare[-1] in 'SML':  # type: ignore
-                    self.logger.debug("[%s] Message is an Emoji message: %s", msg.uid, emoji_compare)
-                    if emoji_compare[-1] == 'S':
-                        fb_msg.emoji_size = EmojiSize.SMALL
-                    elif emoji_compare[-1] == 'M':
-                        fb_msg.emoji_size = EmojiSize.MEDIUM
-                    elif emoji_compare[-1] == 'L':
-                        fb_msg.emoji_size = EmojiSize.LARGE
-                    fb_msg.text = emoji_compare[:-1]
-                msg.uid = self.client.send(fb_msg, thread_id=thread.uid, thread_type=thread.type)
-            elif msg.type in (MsgType.Image, MsgType.Sticker, MsgType.Animation):
-                msg_uid = self.client.send_image_file(msg.filename, msg.file, msg.mime, message=fb_msg,
-                                                      thread_id=thread.uid, thread_type=thread.type)
-                if msg_uid.startswith('mid.$'):
-                    self.client.sent_messages.add(msg_uid)
-                    self.logger.debug("Sent message with ID %s", msg_uid)
-                msg.uid = msg_uid
-            elif msg.type == MsgType.Voice:
-                files = self.upload_file(msg, voice_clip=True)
-                msg_uid = self.client._sendFiles(files=files, message=fb_msg,
-                                                 thread_id=thread.uid, thread_type=thread.type)
-                if msg_uid.startswith('mid.$'):
-                    self.client.sent_messages.add(msg_uid)
-                    self.logger.debug("Sent message with ID %s", msg_uid)
-                msg.uid = msg_uid
-            elif msg.type in (MsgType.File, MsgType.Video):
-                files = self.upload_file(msg)
-                msg_uid = self.client._sendFiles(files=files, message=fb_msg,
-                                                 thread_id=thread.uid, thread_type=thread.type)
-                if msg_uid.startswith('mid.$'):
-                    self.client.sent_messages.add(msg_uid)
-                    self.logger.debug("Sent message with ID %s", msg_uid)
-                msg.uid = msg_uid
-            elif msg.type == MsgType.Status:
-                assert (isinstance(msg.attributes, StatusAttribute))
-                status: StatusAttribute = msg.attributes
-                if status.status_type in (StatusAttribute.Types.TYPING,
-                                          StatusAttribute.Types.UPLOADING_VOICE,
-                                          StatusAttribute.Types.UPLOADING_VIDEO,
-                                          StatusAttribute.Types.UPLOADING_IMAGE,
-                                          StatusAttribute.Types.UPLOADING_FILE):
-                    self.client.setTypingStatus(TypingStatus.TYPING, thread_id=thread.uid, thread_type=thread.type)
-                    threading.Timer(status.timeout / 1000, self.stop_typing, args=(thread.uid, thread.type)).start()
-            elif msg.type == MsgType.Link:
-                assert (isinstance(msg.attributes, LinkAttribute))
-                link: LinkAttribute = msg.attributes
-                if self.flag('send_link_with_description'):
-                    info: Tuple[str, ...] = (link.title,)
-                    if link.description:
-                        info += (link.description,)
-                    info += (link.url,)
-                    text = "\n".join(info)
-                else:
-                    text = link.url
-                if fb_msg.text:
-                    text = fb_msg.text + "\n" + text
-                fb_msg.text = text
-                msg.uid = self.client.send(fb_msg, thread_id=thread.uid, thread_type=thread.type)
-            elif msg.type == MsgType.Location:
-                assert (isinstance(msg.attributes, LocationAttribute))
-                location_attr: LocationAttribute = msg.attributes
-                location = LocationAttachment(latitude=location_attr.latitude,
-                                              longitude=location_attr.longitude)
-                self.client.sendPinnedLocation(location, fb_msg, thread_id=thread.uid, thread_type=thread.type)
-            else:
+                mentions = [Mention(member.id, start, end - start)
+                            for (start, end), member in msg.substitutions.items()]
+                if debug:
+                    self.logger.debug("[%s] Message has substitutions: %s", msg.uid, msg.substitutions)
+                    self.logger.debug("[%s] Translated to mentions: %s", msg.uid, mentions)
+
+            sender = self.senders.get(msg.type)
+            if sender is None:
                 raise EFBMessageTypeNotSupported()
+
+            reply_to_id = msg.target.uid if msg.target and msg.target.uid else None
+            fb_msg = Message(text=msg.text, mentions=mentions, reply_to_id=reply_to_id)
+            thread_uid, thread_type = self.resolve_thread(chat_uid)
+
+            sender(msg, fb_msg, thread_uid, thread_type)
             return msg
+        except FBchatException:
+            # Thread may have changed, look it up again next time
+            with self.thread_cache_lock:
+                self.thread_cache.pop(chat_uid, None)
+            raise
         finally:
-            if msg.file and not msg.file.closed:
-                msg.file.close()
+            file = msg.file
+            if file is not None and not getattr(file, 'closed', True):
+                file.close()
+            self.mark_as_read(chat_uid)
+
+    def _send_text(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        if not msg.text:
+            # Nothing to match against stickers or emoji
+            fb_msg.text = None
+            msg.uid = self.client.send(fb_msg, thread_id=thread_uid, thread_type=thread_type)
+            return
+        # Remove variation selector-16 (force colored emoji) for
+        # matching.
+        emoji_compare = msg.text.replace("\uFE0F", "")
+        # Thumbs-up messages are at most 2 characters long
+        sticker = self.THUMBS_UP_STICKERS.get(emoji_compare) if len(emoji_compare) <= 2 else None
+        if sticker:
+            fb_msg.sticker = sticker
+            fb_msg.text = None
+        elif len(emoji_compare) >= 2 and emoji_compare[-1] in ('S', 'M', 'L') \
+                and emoji_compare[:-1] in self.EMOJI_SET:
+            self.logger.debug("[%s] Message is an Emoji message: %s", msg.uid, emoji_compare)
+            fb_msg.emoji_size = self.EMOJI_SIZES[emoji_compare[-1]]
+            fb_msg.text = emoji_compare[:-1]
+        msg.uid = self.client.send(fb_msg, thread_id=thread_uid, thread_type=thread_type)
+
+    def _send_image(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        msg_uid = self.client.send_image_file(msg.filename, msg.file, msg.mime, message=fb_msg,
+                                              thread_id=thread_uid, thread_type=thread_type)
+        self._set_sent_message_id(msg, msg_uid)
+
+    def _send_voice(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        files = self.upload_file(msg, voice_clip=True)
+        msg_uid = self.client._sendFiles(files=files, message=fb_msg,
+                                         thread_id=thread_uid, thread_type=thread_type)
+        self._set_sent_message_id(msg, msg_uid)
+
+    def _send_file(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        files = self.upload_file(msg)
+        msg_uid = self.client._sendFiles(files=files, message=fb_msg,
+                                         thread_id=thread_uid, thread_type=thread_type)
+        self._set_sent_message_id(msg, msg_uid)
+
+    def _send_status(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        assert (isinstance(msg.attributes, StatusAttribute))
+        status: StatusAttribute = msg.attributes
+        if status.status_type in self.TYPING_STATUSES:
+            self.client.setTypingStatus(TypingStatus.TYPING, thread_id=thread_uid, thread_type=thread_type)
+            timer = threading.Timer(status.timeout / 1000, self.stop_typing, args=(thread_uid, thread_type))
+            timer.daemon = True
+            timer.start()
+
+    def _send_link(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        assert (isinstance(msg.attributes, LinkAttribute))
+        link: LinkAttribute = msg.attributes
+        if self.send_link_with_description:
+            parts: List[str] = [link.title]
+            if link.description:
+                parts.append(link.description)
+            parts.append(link.url)
+            text = "\n".join(parts)
+        else:
+            text = link.url
+        if fb_msg.text:
+            text = fb_msg.text + "\n" + text
+        fb_msg.text = text
+        msg.uid = self.client.send(fb_msg, thread_id=thread_uid, thread_type=thread_type)
+
+    def _send_location(self, msg: EFBMessage, fb_msg: Message, thread_uid: str, thread_type: ThreadType):
+        assert (isinstance(msg.attributes, LocationAttribute))
+        location_attr: LocationAttribute = msg.attributes
+        location = LocationAttachment(latitude=location_attr.latitude,
+                                      longitude=location_attr.longitude)
+        self.client.sendPinnedLocation(location, fb_msg, thread_id=thread_uid, thread_type=thread_type)
+
+    def _set_sent_message_id(self, msg: EFBMessage, msg_uid: str):
+        """Record ID of a message sent with files, so that it is not delivered back to master."""
+        if msg_uid.startswith('mid.$'):
+            self.client.add_sent_message(msg_uid)
+            self.logger.debug("Sent message with ID %s", msg_uid)
+        msg.uid = MessageID(msg_uid)
+
+    def mark_as_read(self, chat_uid: str):
+        """
+        Mark a chat as read once no more messages are sent to it
+        for :attr:`MARK_AS_READ_DELAY` seconds, so that a burst of
+        messages results in only one request.
+        """
+        with self.pending_read_lock:
+            self.pending_read[chat_uid] = time.monotonic()
+            if self.pending_read_timer is None:
+                self._start_mark_as_read_timer(self.MARK_AS_READ_DELAY)
+
+    def flush_mark_as_read(self):
+        """Mark all pending chats as read immediately."""
+        with self.pending_read_lock:
+            chat_uids = list(self.pending_read)
+            self.pending_read.clear()
+            if self.pending_read_timer is not None:
+                self.pending_read_timer.cancel()
+                self.pending_read_timer = None
+        if chat_uids:
+            self._send_read_status(chat_uids)
+
+    def _start_mark_as_read_timer(self, delay: float):
+        self.pending_read_timer = threading.Timer(delay, self._mark_pending_as_read)
+        self.pending_read_timer.daemon = True
+        self.pending_read_timer.start()
+
+    def _mark_pending_as_read(self):
+        now = time.monotonic()
+        with self.pending_read_lock:
+            chat_uids = [uid for uid, last_sent in self.pending_read.items()
+                         if now - last_sent >= self.MARK_AS_READ_DELAY]
+            for uid in chat_uids:
+                del self.pending_read[uid]
+            if self.pending_read:
+                # Wait until the earliest remaining chat is due
+                earliest = min(self.pending_read.values())
+                self._start_mark_as_read_timer(max(earliest + self.MARK_AS_READ_DELAY - now, 0))
+            else:
+                self.pending_read_timer = None
+        if chat_uids:
+            self._send_read_status(chat_uids)
+
+    def _send_read_status(self, chat_uids: List[str]):
+        try:
             self.client.markAsSeen()
-            self.client.markAsRead(msg.chat.uid)
+            self.client.markAsRead(chat_uids)
+        except FBchatException:
+            self.logger.exception("Error occurred while marking chats %s as read.", chat_uids)
 
-    def stop_typing(self, timeout: int, thread_uid: str, thread_type: ThreadType):
-        """Wait for a number of milliseconds, and stop typing."""
-        time.sleep(timeout / 1000)
+    def stop_typing(self, thread_uid: str, thread_type: ThreadType):
+        """Stop typing, called by a timer when the typing status expires."""
         self.client.setTypingStatus(TypingStatus.STOPPED, thread_id=thread_uid, thread_type=thread_type)
 
     def upload_file(self, msg: EFBMessage, voice_clip=False) -> List[Tuple[int, str]]:
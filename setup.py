@@ -1,11 +1,13 @@
+import re
 import sys
+from pathlib import Path
 from setuptools import setup, find_packages
 
 if sys.version_info < (3, 6):
     raise Exception("Python 3.6 or higher is required. Your version is %s." % sys.version)
 
-__version__ = ""
-exec(open('efb_fb_messenger_slave/__version__.py').read())
+__version__ = re.search(r"__version__\s*=\s*['\"]([^'\"]+)['\"]",
+                        Path('efb_fb_messenger_slave/__version__.py').read_text()).group(1)
 
 long_description = open('README.rst').read()
 
@@ -43,6 +45,9 @@ setup(
         "bullet",
         "cjkwrap"
     ],
+    extras_require={
+        "streaming": ["requests-toolbelt"],
+    },
     entry_points={
         "console_scripts": ["efms-auth = efb_fb_messenger_slave.__main__:main"],
         "ehforwarderbot.slave": ["blueset.fbmessenger = efb_fb_messenger_slave:FBMessengerChannel"],
@@ -0,0 +1,76 @@
+import io
+import json
+from unittest import mock
+
+import pytest
+import requests
+from fbchat import Client
+
+from efb_fb_messenger_slave import efms_client
+
+
+def test_unwrap_facebook_url():
+    assert efms_client.unwrap_facebook_url(
+        "https://external.xx.fbcdn.net/safe_image.php?d=AQ&w=100&url=https%3A%2F%2Fexample.com%2Fa.png%3Fb%3Dc&cfs=1"
+    ) == "https://example.com/a.png?b=c"
+    assert efms_client.unwrap_facebook_url(
+        "https://l.facebook.com/l.php?u=https%3A%2F%2Fexample.com%2Fpath+name&h=AT0"
+    ) == "https://example.com/path name"
+    assert efms_client.unwrap_facebook_url(
+        "https://l.facebook.com/l.php?h=AT0"
+    ) == "https://l.facebook.com/l.php?h=AT0"
+    assert efms_client.unwrap_facebook_url("https://example.com/") == "https://example.com/"
+
+
+def make_upload_client(*contents):
+    client = efms_client.EFMSClient.__new__(efms_client.EFMSClient)
+    client._state = mock.Mock()
+    client._state.get_params.return_value = {"__a": 1, "fb_dtsg": "token"}
+    responses = []
+    for content in contents:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"for (;;);" + json.dumps(content).encode()
+        responses.append(response)
+    client._state._session.post.side_effect = responses
+    return client
+
+
+def test_upload_streams_files():
+    pytest.importorskip("requests_toolbelt")
+    client = make_upload_client({"payload": {"metadata": [{"filetype": "video/mp4", "video_id": 42}]}})
+    file = io.BytesIO(b"\0" * efms_client.STREAMING_UPLOAD_MIN_SIZE)
+
+    assert client._upload([("video.mp4", file, "video/mp4")], voice_clip=True) == [(42, "video/mp4")]
+
+    (url,), kwargs = client._state._session.post.call_args
+    assert url == "https://upload.facebook.com/ajax/mercury/upload.php"
+    encoder = kwargs["data"]
+    assert kwargs["headers"]["Content-Type"] == encoder.content_type
+    body = encoder.to_string()
+    assert b'name="voice_clip"\r\n\r\nTrue\r\n' in body
+    assert b'name="fb_dtsg"\r\n\r\ntoken\r\n' in body
+    assert b'name="upload_0"; filename="video.mp4"\r\nContent-Type: video/mp4\r\n' in body
+
+
+def test_upload_retries_buffered_on_refresh():
+    pytest.importorskip("requests_toolbelt")
+    client = make_upload_client({"error": 1357004, "errorDescription": "Please refresh"})
+    file = io.BytesIO(b"\0" * efms_client.STREAMING_UPLOAD_MIN_SIZE)
+    files = [("video.mp4", file, "video/mp4")]
+    file.seek(10)
+
+    with mock.patch.object(Client, "_upload", return_value=[(42, "video/mp4")]) as buffered_upload:
+        assert client._upload(files) == [(42, "video/mp4")]
+    buffered_upload.assert_called_once_with(files, voice_clip=False)
+    assert file.tell() == 0
+
+
+def test_upload_small_buffer_not_streamed():
+    client = make_upload_client()
+    files = [("image.png", io.BytesIO(b"png"), "image/png")]
+
+    with mock.patch.object(Client, "_upload", return_value=[(42, "image/png")]) as buffered_upload:
+        assert client._upload(files) == [(42, "image/png")]
+    buffered_upload.assert_called_once_with(files, voice_clip=False)
+    client._state._session.post.assert_not_called()